@@ -0,0 +1,130 @@
+"""
+Alternative Route Search for Tupi SEAIT Navigation System
+Finds up to k meaningfully different routes between two cells of a floor grid
+"""
+
+import heapq
+import time
+from typing import List, Dict, Tuple
+
+from grid_search import CompiledGrid, compile_grid, distances_to, follow_tree
+
+# Defaults for what counts as a meaningfully different route
+MAX_OVERLAP = 0.6    # share of an alternative's cells that may lie on an earlier route
+MAX_STRETCH = 1.5    # alternative length relative to the shortest route
+PENALTY = 1.0        # extra cost of entering a cell per earlier route through it
+
+
+def _penalized_search(compiled: CompiledGrid, source: int, target: int,
+                      distances: List[int], penalties: Dict[int, float]) -> Tuple[List[int], int]:
+    """
+    A* where entering a cell costs 1 plus its penalty.
+
+    The unpenalised distances are an exact lower bound on the remaining cost, so
+    the search stays admissible and only expands cells the penalties divert it to.
+    Returns the path and the number of expanded cells.
+    """
+    g_score = {source: 0.0}
+    came_from = {}
+    queue = [(distances[source], 0, source)]
+    closed = set()
+    counter = 0
+
+    while queue:
+        _, _, current = heapq.heappop(queue)
+        if current in closed:
+            continue
+        closed.add(current)
+
+        if current == target:
+            path = [current]
+            while path[-1] in came_from:
+                path.append(came_from[path[-1]])
+            path.reverse()
+            return path, len(closed)
+
+        for neighbor in compiled.neighbors[current]:
+            if distances[neighbor] == -1 or neighbor in closed:
+                continue
+            tentative_g = g_score[current] + 1 + penalties.get(neighbor, 0.0)
+            if neighbor not in g_score or tentative_g < g_score[neighbor]:
+                g_score[neighbor] = tentative_g
+                came_from[neighbor] = current
+                counter += 1
+                heapq.heappush(queue, (tentative_g + distances[neighbor], counter, neighbor))
+
+    return [], len(closed)
+
+
+def alternative_routes(grid: List[List[int]], start: Tuple[int, int], end: Tuple[int, int],
+                       k: int, accessible_only: bool = False,
+                       max_overlap: float = MAX_OVERLAP, max_stretch: float = MAX_STRETCH,
+                       penalty: float = PENALTY) -> Dict:
+    """
+    Find up to k routes from start to end, shortest first.
+
+    One breadth-first search from end builds the shortest-path tree, stopping at
+    the radius no route within max_stretch can leave; the first route is read
+    off it and every alternative comes from an A* search that uses the tree
+    distances as its heuristic and stays inside that radius. After each search
+    the cells of the found route are penalised so the next search is pushed
+    onto other corridors. A route is kept if it is at most max_stretch times the shortest
+    length and shares at most max_overlap of its cells with any kept route.
+    At most 2 * k searches are run; each kept route reports the cells expanded
+    and the time spent since the previous kept route, rejected searches included.
+    """
+    result = {'routes': [], 'searches': 0, 'search_time_ms': 0.0}
+    if k < 1 or not grid:
+        return result
+
+    compiled = compile_grid(grid, accessible_only)
+    source, target = compiled.index(start), compiled.index(end)
+    if source is None or target is None:
+        return result
+
+    started = time.perf_counter()
+    distances = distances_to(compiled, target, source, max_stretch)
+    if distances[source] == -1:
+        return result
+
+    # The shortest route is charged with building the tree it was read from
+    shortest = follow_tree(compiled, source, distances)
+    kept = [(shortest, set(shortest))]
+    timings = [{'expanded': sum(1 for distance in distances if distance != -1),
+                'time_ms': round((time.perf_counter() - started) * 1000, 3)}]
+    penalties = {}
+    candidate = shortest
+
+    # Searches whose route was rejected are charged to the next kept route
+    expanded_since, elapsed_since = 0, 0.0
+
+    # A route of one or two cells has no room for a different alternative
+    while len(shortest) >= 3 and len(kept) < k and result['searches'] < 2 * k:
+        for cell in candidate:
+            penalties[cell] = penalties.get(cell, 0.0) + penalty
+
+        started = time.perf_counter()
+        candidate, expanded = _penalized_search(compiled, source, target, distances, penalties)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        result['searches'] += 1
+        result['search_time_ms'] += elapsed_ms
+        expanded_since += expanded
+        elapsed_since += elapsed_ms
+        if not candidate:
+            break
+
+        cells = set(candidate)
+        if len(candidate) > max_stretch * len(shortest):
+            continue
+        if any(len(cells & other) > max_overlap * len(cells) for _, other in kept):
+            continue
+
+        kept.append((candidate, cells))
+        timings.append({'expanded': expanded_since, 'time_ms': round(elapsed_since, 3)})
+        expanded_since, elapsed_since = 0, 0.0
+
+    for (path, _), timing in zip(kept, timings):
+        result['routes'].append(dict(timing, path=[compiled.position(cell) for cell in path],
+                                     length=len(path)))
+    result['search_time_ms'] = round(result['search_time_ms'], 3)
+    return result
@@ -1,10 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, make_response
 from flask_cors import CORS
 from queue import PriorityQueue
 import json
 import os
 from typing import List, Dict, Tuple, Optional
 
+import alternative_routes
+import coalescing
+import grid_search
+import offline_bundle
+
 app = Flask(__name__)
 CORS(app)  # Enable CORS for Flutter app
 
@@ -12,6 +17,25 @@ CORS(app)  # Enable CORS for Flutter app
 buildings = {}
 current_building = None
 
+# Offline route bundles, built by offline_bundle.py and stored per version on disk.
+# The latest one is cached per building as (mtime, bundle, gzip bytes), and
+# diffs to it per building as (from version, hash) -> gzip bytes.
+BUNDLE_DIR = os.path.join('..', 'assets', 'bundles')
+bundles = {}
+bundle_diffs = {}
+
+# Upper bound on alternative routes per request, to keep k > 1 affordable
+MAX_ALTERNATIVES = 5
+
+# Identical concurrent route/search requests share one computation.
+# Set COALESCE_STORE_DIR to also share them between worker processes.
+COALESCE_TIMEOUT = float(os.environ.get('COALESCE_TIMEOUT', '5'))
+COALESCE_STORE_DIR = os.environ.get('COALESCE_STORE_DIR')
+single_flight = coalescing.SingleFlight(
+    timeout=COALESCE_TIMEOUT,
+    store=coalescing.FileStore(COALESCE_STORE_DIR) if COALESCE_STORE_DIR else None
+)
+
 def load_building_data():
     """Load building data from JSON files"""
     global buildings, current_building
@@ -139,21 +163,12 @@ def a_star(start: Tuple[int, int], end: Tuple[int, int], floor: int = 1, accessi
             if not (0 <= neighbor[0] < rows and 0 <= neighbor[1] < cols):
                 continue
 
-            # Check if walkable
-            cell_type = grid[neighbor[0]][neighbor[1]]
-            if cell_type == 1:  # Wall
-                continue
-
-            # For accessible paths, avoid stairs if possible
-            if accessible_only and cell_type == 2:  # Stairs
+            # Check if walkable (accessible paths never take stairs)
+            if not grid_search.is_passable(grid[neighbor[0]][neighbor[1]], accessible_only):
                 continue
 
             tentative_g = g_score[current] + 1
 
-            # Add penalty for stairs in accessible mode
-            if accessible_only and cell_type == 2:
-                tentative_g += 10
-
             if neighbor not in g_score or tentative_g < g_score[neighbor]:
                 g_score[neighbor] = tentative_g
                 priority = tentative_g + heuristic(end, neighbor)
@@ -162,6 +177,23 @@ def a_star(start: Tuple[int, int], end: Tuple[int, int], floor: int = 1, accessi
 
     return []
 
+def find_path(start: Tuple[int, int], end: Tuple[int, int], floor: int = 1, accessible_only: bool = False) -> List[Tuple[int, int]]:
+    """A* pathfinding, shared with identical concurrent requests"""
+    building_id = current_building['id'] if current_building else None
+    key = (building_id, list(start), list(end), floor, accessible_only)
+    return single_flight.do('path', key, lambda: a_star(start, end, floor, accessible_only))
+
+def find_alternative_routes(start: Tuple[int, int], end: Tuple[int, int], floor: int, k: int,
+                            accessible_only: bool = False,
+                            max_overlap: float = alternative_routes.MAX_OVERLAP,
+                            max_stretch: float = alternative_routes.MAX_STRETCH) -> Dict:
+    """Up to k different routes, shared with identical concurrent requests"""
+    building_id = current_building['id'] if current_building else None
+    key = (building_id, list(start), list(end), floor, accessible_only, k, max_overlap, max_stretch)
+    return single_flight.do('alternatives', key, lambda: alternative_routes.alternative_routes(
+        get_floor_grid(floor), start, end, k, accessible_only,
+        max_overlap=max_overlap, max_stretch=max_stretch))
+
 def find_room_by_id(room_id: str) -> Optional[Dict]:
     """Find a room by its ID"""
     if current_building is None:
@@ -173,15 +205,17 @@ def find_room_by_id(room_id: str) -> Optional[Dict]:
                 return room
     return None
 
-def search_rooms(query: str) -> List[Dict]:
-    """Search rooms by name, type, or department"""
-    if current_building is None:
+def search_rooms(query: str, building: Optional[Dict] = None) -> List[Dict]:
+    """Search rooms by name, type, or department (in the current building by default)"""
+    if building is None:
+        building = current_building
+    if building is None:
         return []
 
     query_lower = query.lower()
     results = []
 
-    for floor in current_building['floors']:
+    for floor in building['floors']:
         for room in floor['rooms']:
             # Search in name, type, and department
             if (query_lower in room['name'].lower() or
@@ -245,6 +279,69 @@ def _get_direction(from_pos: Tuple[int, int], to_pos: Tuple[int, int]) -> str:
         return "east"
     return "unknown"
 
+def get_offline_bundle(building_id: str) -> Optional[Tuple[Dict, bytes]]:
+    """Get the latest stored offline bundle for a building along with its gzip bytes"""
+    path = offline_bundle.bundle_path(BUNDLE_DIR, building_id)
+    try:
+        modified = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = bundles.get(building_id)
+    if cached is None or cached[0] != modified:
+        data = offline_bundle.load_bundle_data(BUNDLE_DIR, building_id)
+        if data is None:
+            return None
+        cached = (modified, offline_bundle.decompress(data), data)
+        bundles[building_id] = cached
+        bundle_diffs.pop(building_id, None)
+    return cached[1], cached[2]
+
+def _gzip_json_response(etag: str, payload: Optional[Dict] = None, data: Optional[bytes] = None):
+    """
+    Return a JSON payload, or its already gzip-compressed bytes, compressed
+    when the client accepts it and honouring If-None-Match
+    """
+    gzipped = 'gzip' in request.accept_encodings
+    if gzipped:
+        # Each representation needs its own validator
+        etag = f"{etag}-gz"
+
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    elif gzipped:
+        response = make_response(data if data is not None else offline_bundle.compress(payload))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.mimetype = 'application/json'
+    else:
+        response = jsonify(payload if payload is not None else offline_bundle.decompress(data))
+
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _route_option(data: Dict, name: str, default, cast):
+    """A route option from the request body, falling back to the query string"""
+    return cast(data.get(name, request.args.get(name, default)))
+
+def _find_routes(data: Dict, start: Tuple[int, int], end: Tuple[int, int],
+                 floor: int, accessible_only: bool) -> List[Dict]:
+    """
+    The shortest route plus up to alternatives - 1 different ones, each with
+    its path, length, instructions, expanded cells and search time
+    """
+    k = _route_option(data, 'alternatives', 1, int)
+    found = find_alternative_routes(
+        start, end, floor, max(1, min(k, MAX_ALTERNATIVES)), accessible_only,
+        max_overlap=_route_option(data, 'max_overlap', alternative_routes.MAX_OVERLAP, float),
+        max_stretch=_route_option(data, 'max_stretch', alternative_routes.MAX_STRETCH, float))
+
+    start_room = data.get('start_room', {'name': 'your starting point'})
+    end_room = data.get('end_room', {'name': 'your destination'})
+    return [dict(route, instructions=generate_instructions(start, end, route['path'],
+                                                           start_room, end_room))
+            for route in found['routes']]
+
 # API Routes
 
 @app.route('/path', methods=['POST'])
@@ -256,11 +353,13 @@ def get_path():
         end = tuple(data['end'])
         floor = data.get('floor', 1)
 
-        path = a_star(start, end, floor)
+        routes = _find_routes(data, start, end, floor, accessible_only=False)
+        path = routes[0]['path'] if routes else []
         return jsonify({
             'path': path,
             'length': len(path),
-            'floor': floor
+            'floor': floor,
+            'routes': routes
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -274,12 +373,14 @@ def get_accessible_path():
         end = tuple(data['end'])
         floor = data.get('floor', 1)
 
-        path = a_star(start, end, floor, accessible_only=True)
+        routes = _find_routes(data, start, end, floor, accessible_only=True)
+        path = routes[0]['path'] if routes else []
         return jsonify({
             'path': path,
             'length': len(path),
             'floor': floor,
-            'accessible': True
+            'accessible': True,
+            'routes': routes
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 400
@@ -295,7 +396,7 @@ def get_instructions():
         end_room = data['end_room']
         floor = data.get('floor', 1)
 
-        path = a_star(start, end, floor)
+        path = find_path(start, end, floor)
         if not path:
             return jsonify({'error': 'No path found'}), 404
 
@@ -331,16 +432,10 @@ def search_rooms_endpoint():
         query = request.args.get('q', '')
         building_id = request.args.get('building')
 
-        if building_id and building_id in buildings:
-            # Search in specific building
-            global current_building
-            old_building = current_building
-            current_building = buildings[building_id]
-            results = search_rooms(query)
-            current_building = old_building
-        else:
-            # Search in current building
-            results = search_rooms(query)
+        # Search in a specific building, or the current one
+        building = buildings.get(building_id, current_building)
+        key = (building['id'] if building else None, query.lower())
+        results = single_flight.do('search', key, lambda: search_rooms(query, building))
 
         return jsonify({
             'rooms': results,
@@ -380,6 +475,52 @@ def get_floor(floor_number):
     else:
         return jsonify({'error': 'No building loaded'}), 404
 
+@app.route('/bundle/<building_id>', methods=['GET'])
+def get_bundle(building_id):
+    """Get the compressed offline route bundle for a building"""
+    stored = get_offline_bundle(building_id)
+    if stored is None:
+        return jsonify({'error': 'No offline bundle built for this building'}), 404
+
+    bundle, data = stored
+    return _gzip_json_response(bundle['hash'], data=data)
+
+@app.route('/bundle/<building_id>/diff', methods=['GET'])
+def get_bundle_diff(building_id):
+    """Get the changes between a stored bundle version and the current one"""
+    stored = get_offline_bundle(building_id)
+    if stored is None:
+        return jsonify({'error': 'No offline bundle built for this building'}), 404
+
+    from_version = request.args.get('from', type=int)
+    if from_version is None:
+        return jsonify({'error': 'Missing or invalid "from" version'}), 400
+
+    bundle = stored[0]
+    diffs = bundle_diffs.setdefault(building_id, {})
+    key = (from_version, bundle['hash'])
+    data = diffs.get(key)
+    if data is None:
+        old = bundle if from_version == bundle['version'] else \
+            offline_bundle.load_bundle(BUNDLE_DIR, building_id, from_version)
+        if old is None:
+            return jsonify({'error': 'Bundle version not found, fetch the full bundle'}), 404
+
+        data = offline_bundle.compress(offline_bundle.diff_bundles(old, bundle))
+        diffs[key] = data
+
+    return _gzip_json_response(f"{from_version}-{bundle['hash']}", data=data)
+
+@app.route('/coalescing', methods=['GET'])
+def get_coalescing_stats():
+    """Get counts of executed and collapsed route/search requests for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'shared_store': COALESCE_STORE_DIR is not None,
+        'timeout': COALESCE_TIMEOUT,
+        'requests': single_flight.stats()
+    })
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -396,8 +537,8 @@ def index():
         'name': 'Tupi SEAIT Navigation API',
         'version': '1.0.0',
         'endpoints': {
-            'POST /path': 'Find path between two points',
-            'POST /accessible_path': 'Find accessible path',
+            'POST /path': 'Find path between two points (alternatives=k for up to k routes)',
+            'POST /accessible_path': 'Find accessible path (alternatives=k for up to k routes)',
             'POST /instructions': 'Get navigation instructions',
             'GET /building/<id>': 'Get building data',
             'GET /buildings': 'List all buildings',
@@ -405,6 +546,9 @@ def index():
             'GET /room/<id>': 'Get room details',
             'GET /floors': 'List floors',
             'GET /floor/<number>': 'Get floor data',
+            'GET /bundle/<id>': 'Get offline route bundle',
+            'GET /bundle/<id>/diff?from=<version>': 'Get offline bundle changes since a version',
+            'GET /coalescing': 'Collapsed request counts',
             'GET /health': 'Health check'
         }
     })
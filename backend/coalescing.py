@@ -0,0 +1,270 @@
+"""
+Request Coalescing for Tupi SEAIT Navigation System
+Collapses identical concurrent route and search computations into a single run
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process coalescing is available
+    fcntl = None
+
+
+class CoalescedError(RuntimeError):
+    """Raised in a follower when the leader computing the same request failed"""
+
+
+class CoalesceTimeout(TimeoutError):
+    """Raised when a follower gave up waiting for both the leader and its replacement"""
+
+
+class _Call:
+    """One in-flight computation that followers can wait on"""
+
+    def __init__(self, takeover: bool = False):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.takeover = takeover
+
+
+class FileStore:
+    """
+    Shares in-flight computations between worker processes on one machine.
+
+    Leaders are elected with a POSIX record lock on one byte of a shared lock
+    file, chosen by hashing the key, so the lock is released automatically if
+    a leader process dies and the lock file is never deleted. The leader writes
+    its result to a per-key file before unlocking; followers only accept
+    results written after they started waiting, and result files are swept
+    once they are older than `result_linger` seconds.
+
+    Requires fcntl, i.e. a Unix host (where multi-worker servers run anyway).
+    """
+
+    # Byte range the key hashes are spread over in the lock file; the range
+    # above it holds the takeover slots used when a leader is too slow
+    LOCK_SLOTS = 2 ** 31
+
+    def __init__(self, directory: str, result_linger: float = 1.0, poll_interval: float = 0.01):
+        if fcntl is None:
+            raise RuntimeError("FileStore needs fcntl, which is not available on this platform")
+
+        self.directory = directory
+        self.result_linger = result_linger
+        self.poll_interval = poll_interval
+        os.makedirs(directory, exist_ok=True)
+
+        # Record locks belong to the process and are all dropped when any
+        # descriptor of the file is closed, so keep a single one open for good
+        self._lock_fd = os.open(os.path.join(directory, 'coalesce.lock'), os.O_CREAT | os.O_RDWR)
+        self._last_sweep = 0.0
+
+    def _slot(self, key: str):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return int(digest[:8], 16) % self.LOCK_SLOTS, os.path.join(self.directory, digest + '.json')
+
+    def _try_lock(self, slot: int) -> bool:
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, slot)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, slot: int):
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, slot)
+
+    def _read_result(self, result_path: str, started: float) -> Optional[Dict]:
+        """Read the result of a leader that finished after we started waiting"""
+        try:
+            with open(result_path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry['written'] >= started else None
+
+    def _write_result(self, result_path: str, entry: Dict):
+        entry['written'] = time.time()
+        temp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, result_path)
+        self._sweep()
+
+    def _sweep(self):
+        """Delete result files no waiting follower can still need"""
+        now = time.time()
+        if now - self._last_sweep < self.result_linger:
+            return
+        self._last_sweep = now
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(('.json', '.tmp')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.result_linger:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def run(self, key: str, fn: Callable, timeout: float):
+        """
+        Run fn once across processes for key.
+
+        Returns (value, collapsed). If the leader process takes longer than the
+        timeout, one follower process takes over through a second lock slot;
+        after twice the timeout the remaining followers raise CoalesceTimeout
+        rather than all computing the value at once.
+        """
+        slot, result_path = self._slot(key)
+        takeover_slot = slot + self.LOCK_SLOTS
+        started = time.time()
+
+        held = slot if self._try_lock(slot) else None
+        while held is None:
+            entry = self._read_result(result_path, started)
+            if entry is not None:
+                if 'error' in entry:
+                    raise CoalescedError(entry['error'])
+                return entry['value'], True
+
+            waited = time.time() - started
+            if self._try_lock(slot):
+                held = slot
+            elif waited > timeout and self._try_lock(takeover_slot):
+                held = takeover_slot
+            elif waited > 2 * timeout:
+                raise CoalesceTimeout(f"Timed out waiting for coalesced request {key}")
+            else:
+                time.sleep(self.poll_interval)
+
+        try:
+            # The previous leader may have finished between our last poll and the lock
+            entry = self._read_result(result_path, started)
+            if entry is not None:
+                if 'error' in entry:
+                    raise CoalescedError(entry['error'])
+                return entry['value'], True
+
+            try:
+                value = fn()
+            except Exception as e:
+                self._write_result(result_path, {'error': str(e)})
+                raise
+            self._write_result(result_path, {'value': value})
+            return value, False
+        finally:
+            self._unlock(held)
+
+
+class SingleFlight:
+    """
+    Lets only one caller compute the value for a key at a time.
+
+    Concurrent callers with the same key wait for the leader's result, or get
+    a CoalescedError chained to the leader's exception if it failed. If the
+    leader takes longer than `timeout` seconds, exactly one waiting follower
+    takes over as the new leader and the others wait for it instead; if that
+    one is slow too, the rest raise CoalesceTimeout. With a
+    FileStore, leaders are additionally coalesced across worker processes.
+    """
+
+    def __init__(self, timeout: float = 5.0, store: Optional[FileStore] = None):
+        self.timeout = timeout
+        self.store = store
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def _count(self, name: str, counter: str):
+        with self._lock:
+            stats = self._stats.setdefault(name, {'executed': 0, 'collapsed': 0, 'failed': 0,
+                                                  'errors': 0, 'timeouts': 0})
+            stats[counter] += 1
+
+    def do(self, name: str, key: tuple, fn: Callable):
+        """Run fn for the normalised key, sharing the result with identical concurrent calls"""
+        full_key = json.dumps([name, key], sort_keys=True)
+
+        with self._lock:
+            call = self._calls.get(full_key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[full_key] = call
+
+        while not leader:
+            if call.event.wait(self.timeout):
+                if call.error is not None:
+                    self._count(name, 'failed')
+                    # A fresh exception per follower, so their tracebacks don't pile up on the leader's
+                    raise CoalescedError(str(call.error)) from call.error
+                self._count(name, 'collapsed')
+                return call.result
+
+            # The leader is taking too long: the first follower here replaces it
+            # and everyone else waits for that follower. A replacement that is
+            # slow as well means the computation is, so stop waiting then.
+            self._count(name, 'timeouts')
+            with self._lock:
+                current = self._calls.get(full_key)
+                if current is call and not call.event.is_set():
+                    if call.takeover:
+                        raise CoalesceTimeout(f"Timed out waiting for coalesced request {full_key}")
+                    call = _Call(takeover=True)
+                    self._calls[full_key] = call
+                    leader = True
+                elif current is not None:
+                    call = current
+
+        try:
+            call.result = self._execute(name, full_key, fn)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                current = self._calls.get(full_key)
+                if current is call:
+                    del self._calls[full_key]
+                elif current is not None and call.error is None and not current.event.is_set():
+                    # Replaced for being slow but finished first: release the replacement's followers
+                    current.result = call.result
+                    current.event.set()
+            call.event.set()
+
+    def _execute(self, name: str, full_key: str, fn: Callable):
+        try:
+            if self.store is None:
+                result, collapsed = fn(), False
+            else:
+                result, collapsed = self.store.run(full_key, fn, self.timeout)
+        except CoalesceTimeout:
+            self._count(name, 'timeouts')
+            raise
+        except CoalescedError:
+            self._count(name, 'failed')
+            raise
+        except Exception:
+            self._count(name, 'errors')
+            raise
+
+        self._count(name, 'collapsed' if collapsed else 'executed')
+        return result
+
+    def stats(self) -> Dict:
+        """
+        Per-name request counts: executed by a leader, collapsed onto a leader's
+        result, failed with a leader's error, errors raised by a leader, and
+        waits that timed out
+        """
+        with self._lock:
+            return {name: dict(counts) for name, counts in self._stats.items()}
@@ -0,0 +1,115 @@
+"""
+Compiled Floor Grids for Tupi SEAIT Navigation System
+Single home of the movement rules shared by A*, alternative routes and offline bundles
+"""
+
+from collections import deque
+from typing import List, Tuple, Optional
+
+# Cell types: 0=walkable, 1=wall, 2=stairs, 3=elevator
+WALL = 1
+STAIRS = 2
+
+
+def is_passable(cell_type: int, accessible_only: bool = False) -> bool:
+    """Whether a route may step onto a cell of this type (accessible routes never take stairs)"""
+    return cell_type != WALL and not (accessible_only and cell_type == STAIRS)
+
+
+class CompiledGrid:
+    """A floor grid flattened to cell indices with precomputed walkable neighbours"""
+
+    def __init__(self, grid: List[List[int]], accessible_only: bool = False):
+        self.grid = grid
+        self.rows = len(grid)
+        self.cols = len(grid[0]) if self.rows else 0
+        self.neighbors = []
+
+        for r in range(self.rows):
+            for c in range(self.cols):
+                cells = []
+                if grid[r][c] != WALL:
+                    for dr, dc in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+                        nr, nc = r + dr, c + dc
+                        if 0 <= nr < self.rows and 0 <= nc < self.cols and \
+                                is_passable(grid[nr][nc], accessible_only):
+                            cells.append(nr * self.cols + nc)
+                self.neighbors.append(tuple(cells))
+
+        # Stairs can be left but not entered in accessible mode, so moves are not
+        # always symmetric; searches towards a target walk these reverse links
+        predecessors = [[] for _ in self.neighbors]
+        for index, cells in enumerate(self.neighbors):
+            for cell in cells:
+                predecessors[cell].append(index)
+        self.predecessors = [tuple(cells) for cells in predecessors]
+
+    def index(self, pos: Tuple[int, int]) -> Optional[int]:
+        """Cell index of a walkable position, or None if outside the grid or a wall"""
+        if not (0 <= pos[0] < self.rows and 0 <= pos[1] < self.cols):
+            return None
+        if self.grid[pos[0]][pos[1]] == WALL:
+            return None
+        return pos[0] * self.cols + pos[1]
+
+    def position(self, index: int) -> Tuple[int, int]:
+        return (index // self.cols, index % self.cols)
+
+
+# Compiled grids keyed by grid identity. Floor grids are loaded once and
+# replaced, never edited in place, so the same object always has the same cells.
+_compiled_grids = {}
+_MAX_COMPILED_GRIDS = 64
+
+
+def compile_grid(grid: List[List[int]], accessible_only: bool = False) -> CompiledGrid:
+    """Get the compiled form of a grid, built once per loaded grid object"""
+    key = (id(grid), accessible_only)
+    compiled = _compiled_grids.get(key)
+    # The cached entry keeps its grid alive, so a matching id is the same grid
+    if compiled is None or compiled.grid is not grid:
+        if len(_compiled_grids) >= _MAX_COMPILED_GRIDS:
+            _compiled_grids.clear()
+        compiled = CompiledGrid(grid, accessible_only)
+        _compiled_grids[key] = compiled
+    return compiled
+
+
+def distances_to(compiled: CompiledGrid, target: int, source: Optional[int] = None,
+                 max_stretch: Optional[float] = None) -> List[int]:
+    """
+    Step distance from every cell to target (-1 if unreachable), by breadth-first search.
+
+    Given a source and max_stretch, the search stops at the largest distance a
+    cell on a route at most max_stretch times the shortest one can have, so
+    only that neighbourhood of the floor is labelled.
+    """
+    distances = [-1] * len(compiled.neighbors)
+    distances[target] = 0
+    limit = 0 if source == target and max_stretch is not None else None
+    queue = deque([target])
+    while queue:
+        current = queue.popleft()
+        if limit is not None and distances[current] >= limit:
+            break
+        for neighbor in compiled.predecessors[current]:
+            if distances[neighbor] == -1:
+                distances[neighbor] = distances[current] + 1
+                queue.append(neighbor)
+                if neighbor == source and max_stretch is not None:
+                    # Routes count cells, one more than their steps
+                    limit = int(max_stretch * (distances[source] + 1)) - 1
+    return distances
+
+
+def follow_tree(compiled: CompiledGrid, source: int, distances: List[int]) -> List[int]:
+    """Read the shortest route from source off a distances_to tree ([] if unreachable)"""
+    if distances[source] == -1:
+        return []
+
+    path = [source]
+    while distances[path[-1]] > 0:
+        current = path[-1]
+        path.append(next(neighbor for neighbor in compiled.neighbors[current]
+                         if distances[neighbor] == distances[current] - 1))
+    return path
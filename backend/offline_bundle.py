@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+"""
+Offline Route Bundle Builder for Tupi SEAIT Navigation System
+Packs a building into a compressed, versioned bundle the mobile app can route from offline
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+from typing import List, Dict, Tuple, Optional
+
+from grid_search import compile_grid, distances_to, follow_tree, is_passable
+
+BUNDLE_FORMAT = 2
+
+# Route modes stored for every room pair: normal and wheelchair-accessible
+ROUTE_MODES = {'n': False, 'a': True}
+
+# Accessible routes may leave a stairs cell but never enter one, so they are not
+# reversible and are stored once per direction; normal routes once per pair
+SYMMETRIC_MODES = {'n'}
+
+_DIRECTIONS = {(-1, 0): 'N', (1, 0): 'S', (0, -1): 'W', (0, 1): 'E'}
+_OFFSETS = {letter: offset for offset, letter in _DIRECTIONS.items()}
+
+# Sections diffed entry by entry between bundle versions
+DIFF_SECTIONS = ('building', 'floors', 'grids', 'rooms', 'routes')
+
+
+def _digest(value) -> str:
+    """Short stable hash of any JSON-serialisable value"""
+    raw = json.dumps(value, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+def pack_grid(grid: List[List[int]]) -> Dict:
+    """Pack a floor grid at 2 bits per cell (0=walkable, 1=wall, 2=stairs, 3=elevator)"""
+    rows = len(grid)
+    cols = len(grid[0]) if rows else 0
+    packed = bytearray((rows * cols + 3) // 4)
+
+    for index, cell in enumerate(cell for row in grid for cell in row):
+        if not 0 <= cell <= 3:
+            raise ValueError(f"Cell type {cell} cannot be packed")
+        packed[index // 4] |= cell << (2 * (index % 4))
+
+    return {
+        'rows': rows,
+        'cols': cols,
+        'data': base64.b64encode(bytes(packed)).decode('ascii')
+    }
+
+
+def unpack_grid(packed: Dict) -> List[List[int]]:
+    """Restore a grid produced by pack_grid"""
+    data = base64.b64decode(packed['data'])
+    rows, cols = packed['rows'], packed['cols']
+    return [[(data[(r * cols + c) // 4] >> (2 * ((r * cols + c) % 4))) & 3
+             for c in range(cols)]
+            for r in range(rows)]
+
+
+def encode_route(path: List[Tuple[int, int]]) -> str:
+    """Encode a path as its start cell plus run-length directions, e.g. "3,3:S2E8N2" """
+    if not path:
+        return ''
+
+    runs = []
+    for prev, cell in zip(path, path[1:]):
+        letter = _DIRECTIONS[(cell[0] - prev[0], cell[1] - prev[1])]
+        if runs and runs[-1][0] == letter:
+            runs[-1][1] += 1
+        else:
+            runs.append([letter, 1])
+
+    moves = ''.join(f"{letter}{count}" for letter, count in runs)
+    return f"{path[0][0]},{path[0][1]}:{moves}"
+
+
+def decode_route(encoded: str, reverse: bool = False) -> List[Tuple[int, int]]:
+    """Decode a route produced by encode_route, optionally walking it backwards"""
+    if not encoded:
+        return []
+
+    start, moves = encoded.split(':')
+    row, col = (int(value) for value in start.split(','))
+    path = [(row, col)]
+    for letter, count in re.findall(r'([NSWE])(\d+)', moves):
+        dr, dc = _OFFSETS[letter]
+        for _ in range(int(count)):
+            row, col = row + dr, col + dc
+            path.append((row, col))
+
+    if reverse:
+        path.reverse()
+    return path
+
+
+def _room_position(room: Dict) -> Tuple[int, int]:
+    return (room['position']['row'], room['position']['col'])
+
+
+def route_key(floor_number: int, room_a: str, room_b: str, mode: str) -> str:
+    """Key of the route entry from room_a to room_b; symmetric modes use one key per pair"""
+    if mode in SYMMETRIC_MODES:
+        room_a, room_b = sorted((room_a, room_b))
+    return f"{floor_number}:{room_a}>{room_b}:{mode}"
+
+
+def lookup_route(bundle: Dict, floor_number: int, start_id: str, end_id: str,
+                 accessible_only: bool = False) -> Optional[Dict]:
+    """Return {'distance', 'path'} for a room pair from a bundle, or None if unreachable"""
+    mode = 'a' if accessible_only else 'n'
+    entry = bundle['routes'].get(route_key(floor_number, start_id, end_id, mode))
+    if not entry or entry['r'] is None:
+        return None
+
+    # Symmetric entries run from the lower room id to the higher one
+    return {
+        'distance': entry['d'],
+        'path': decode_route(entry['r'], reverse=mode in SYMMETRIC_MODES and start_id > end_id)
+    }
+
+
+def _grid_changes(old_grid: Optional[List[List[int]]],
+                  grid: List[List[int]]) -> Optional[List[Tuple[int, int, int, int]]]:
+    """Cells whose type changed as (row, col, old, new), or None if the grids don't line up"""
+    if old_grid is None or len(old_grid) != len(grid) or \
+            (grid and len(old_grid[0]) != len(grid[0])):
+        return None
+    return [(r, c, old_grid[r][c], cell)
+            for r, row in enumerate(grid)
+            for c, cell in enumerate(row)
+            if old_grid[r][c] != cell]
+
+
+def _manhattan(a: Tuple[int, int], b: Tuple[int, int]) -> int:
+    return abs(a[0] - b[0]) + abs(a[1] - b[1])
+
+
+def _route_affected(entry: Dict, source: Tuple[int, int], target: Tuple[int, int],
+                    changes: List[Tuple[int, int, int, int]], accessible_only: bool) -> bool:
+    """Whether any changed cell can change the stored route from source to target"""
+    path_cells = None
+    for row, col, old_type, new_type in changes:
+        cell = (row, col)
+        if cell in (source, target):
+            return True
+
+        was_passable = is_passable(old_type, accessible_only)
+        if was_passable == is_passable(new_type, accessible_only):
+            continue
+
+        if not was_passable:
+            # A new opening matters if the rooms were cut off or a detour
+            # through it could beat the stored distance
+            if entry['r'] is None or _manhattan(source, cell) + _manhattan(cell, target) < entry['d']:
+                return True
+        elif entry['r'] is not None:
+            # A new obstacle only matters if it blocks the stored route
+            if path_cells is None:
+                path_cells = set(decode_route(entry['r']))
+            if cell in path_cells:
+                return True
+
+    return False
+
+
+def _build_floor_routes(floor: Dict, previous: Optional[Dict], stats: Dict) -> Dict:
+    """Compute route entries for every room pair on a floor, reusing those no edit can affect"""
+    grid = floor['grid']
+    rooms = sorted(floor.get('rooms', []), key=lambda room: room['id'])
+    routes = {}
+
+    previous_routes = previous['routes'] if previous else {}
+    previous_rooms = previous['rooms'] if previous else {}
+    packed = previous['grids'].get(str(floor['number'])) if previous else None
+    changes = _grid_changes(unpack_grid(packed) if packed else None, grid)
+
+    # Rooms still at the same cell of this floor
+    unmoved = {room['id'] for room in rooms
+               if room['id'] in previous_rooms
+               and previous_rooms[room['id']]['floor'] == floor['number']
+               and _room_position(previous_rooms[room['id']]) == _room_position(room)}
+
+    for mode, accessible_only in ROUTE_MODES.items():
+        stale = {}
+        for i, source in enumerate(rooms):
+            targets = rooms[i + 1:] if mode in SYMMETRIC_MODES else rooms[:i] + rooms[i + 1:]
+            for target in targets:
+                key = route_key(floor['number'], source['id'], target['id'], mode)
+                cached = previous_routes.get(key)
+                if cached is not None and changes is not None and \
+                        source['id'] in unmoved and target['id'] in unmoved and \
+                        not _route_affected(cached, _room_position(source), _room_position(target),
+                                            changes, accessible_only):
+                    routes[key] = cached
+                    stats['reused'] += 1
+                else:
+                    stale.setdefault(target['id'], (target, []))[1].append((key, source))
+
+        if not stale:
+            continue
+
+        # One search tree per target room covers all of its stale pairs
+        compiled = compile_grid(grid, accessible_only)
+        for target, pairs in stale.values():
+            target_index = compiled.index(_room_position(target))
+            distances = distances_to(compiled, target_index) if target_index is not None else None
+            for key, source in pairs:
+                source_index = compiled.index(_room_position(source))
+                path = []
+                if distances is not None and source_index is not None:
+                    path = [compiled.position(cell)
+                            for cell in follow_tree(compiled, source_index, distances)]
+                routes[key] = {
+                    'd': len(path) - 1 if path else None,
+                    'r': encode_route(path) if path else None
+                }
+                stats['computed'] += 1
+
+    return routes
+
+
+def build_bundle(building: Dict, previous: Optional[Dict] = None) -> Dict:
+    """
+    Build the offline bundle for a building.
+
+    When a previous bundle is given, a route is only recomputed if one of its
+    rooms moved or a changed grid cell could block it or open a shorter way,
+    and the version is bumped only if the content actually differs.
+    """
+    source_hash = _digest(building)
+    same_format = previous is not None and previous.get('format') == BUNDLE_FORMAT
+    if same_format and previous['source'] == source_hash:
+        return dict(previous, stats={'computed': 0, 'reused': len(previous['routes'])})
+
+    # A new format starts from scratch but keeps counting versions
+    previous_version = previous['version'] if previous else 0
+    if not same_format:
+        previous = None
+
+    stats = {'computed': 0, 'reused': 0}
+    grids, rooms, routes = {}, {}, {}
+
+    for floor in building['floors']:
+        grids[str(floor['number'])] = pack_grid(floor['grid'])
+        for room in floor.get('rooms', []):
+            rooms[room['id']] = dict(room, floor=floor['number'])
+        routes.update(_build_floor_routes(floor, previous, stats))
+
+    bundle = {
+        'format': BUNDLE_FORMAT,
+        'building': {key: building[key] for key in ('id', 'name', 'description') if key in building},
+        'floors': {str(floor['number']): {'name': floor.get('name'),
+                                          'specialLocations': floor.get('specialLocations', {})}
+                   for floor in building['floors']},
+        'grids': grids,
+        'rooms': rooms,
+        'routes': routes
+    }
+
+    content_hash = _digest({section: bundle[section] for section in DIFF_SECTIONS})
+    if previous is not None and previous['hash'] == content_hash:
+        version = previous['version']
+    else:
+        version = previous_version + 1
+
+    bundle.update(version=version, hash=content_hash, source=source_hash, stats=stats)
+    return bundle
+
+
+def diff_bundles(old: Dict, new: Dict) -> Dict:
+    """Describe how to turn bundle `old` into bundle `new`"""
+    changes = {}
+    for section in DIFF_SECTIONS:
+        before, after = old.get(section, {}), new.get(section, {})
+        upserts = {key: value for key, value in after.items() if before.get(key) != value}
+        removed = sorted(key for key in before if key not in after)
+        if upserts or removed:
+            changes[section] = {'upserts': upserts, 'removed': removed}
+
+    return {
+        'format': BUNDLE_FORMAT,
+        'building_id': new['building']['id'],
+        'from_version': old['version'],
+        'to_version': new['version'],
+        'hash': new['hash'],
+        'changes': changes
+    }
+
+
+def apply_diff(bundle: Dict, diff: Dict) -> Dict:
+    """Apply a diff from diff_bundles to a bundle (mirrors what the mobile client does)"""
+    if bundle['version'] != diff['from_version']:
+        raise ValueError(f"Diff applies to version {diff['from_version']}, "
+                         f"bundle is version {bundle['version']}")
+
+    updated = dict(bundle)
+    for section, change in diff['changes'].items():
+        entries = dict(bundle.get(section, {}))
+        for key in change['removed']:
+            entries.pop(key, None)
+        entries.update(change['upserts'])
+        updated[section] = entries
+
+    updated.update(version=diff['to_version'], hash=diff['hash'])
+    return updated
+
+
+def compress(payload: Dict) -> bytes:
+    """Serialise a bundle or diff to gzip-compressed JSON"""
+    raw = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    return gzip.compress(raw.encode('utf-8'))
+
+
+def decompress(data: bytes) -> Dict:
+    return json.loads(gzip.decompress(data).decode('utf-8'))
+
+
+def bundle_path(directory: str, building_id: str, version: Optional[int] = None) -> str:
+    """Path of a stored bundle; without a version, the latest one"""
+    suffix = 'latest' if version is None else f"v{version}"
+    return os.path.join(directory, f"{building_id}.{suffix}.json.gz")
+
+
+def load_bundle_data(directory: str, building_id: str, version: Optional[int] = None) -> Optional[bytes]:
+    """Read a stored bundle as its gzip-compressed bytes, or None if it does not exist"""
+    path = bundle_path(directory, building_id, version)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_bundle(directory: str, building_id: str, version: Optional[int] = None) -> Optional[Dict]:
+    """Load a stored bundle, or None if it does not exist"""
+    data = load_bundle_data(directory, building_id, version)
+    return decompress(data) if data is not None else None
+
+
+def save_bundle(directory: str, bundle: Dict):
+    """Store a bundle both under its version and as the latest one"""
+    os.makedirs(directory, exist_ok=True)
+    data = compress(bundle)
+    for path in (bundle_path(directory, bundle['building']['id'], bundle['version']),
+                 bundle_path(directory, bundle['building']['id'])):
+        # Write-then-rename so a running server never reads a half-written file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+
+def update_bundle(directory: str, building: Dict) -> Dict:
+    """Rebuild a building's bundle incrementally against the stored latest and save it if changed"""
+    previous = load_bundle(directory, building['id'])
+    bundle = build_bundle(building, previous)
+    if previous is None or any(bundle[field] != previous.get(field)
+                               for field in ('format', 'version', 'hash', 'source')):
+        save_bundle(directory, bundle)
+    return bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline route bundle builder for Navigation System")
+    parser.add_argument("map", help="Building map JSON file")
+    parser.add_argument("--output-dir", default=os.path.join('..', 'assets', 'bundles'),
+                        help="Directory holding versioned bundles")
+    parser.add_argument("--diff-from", type=int,
+                        help="Also write a diff from this stored version to the new one")
+
+    args = parser.parse_args()
+
+    with open(args.map, 'r', encoding='utf-8') as f:
+        building = json.load(f)
+
+    bundle = update_bundle(args.output_dir, building)
+    stats = bundle['stats']
+    print(f"Bundle {building['id']} v{bundle['version']}: "
+          f"{stats['computed']} routes computed, {stats['reused']} reused")
+    print(f"Written to: {bundle_path(args.output_dir, building['id'], bundle['version'])}")
+
+    if args.diff_from is not None and args.diff_from != bundle['version']:
+        old = load_bundle(args.output_dir, building['id'], args.diff_from)
+        if old is None:
+            print(f"Version {args.diff_from} not found in {args.output_dir}")
+            return
+        diff_file = os.path.join(args.output_dir,
+                                 f"{building['id']}.v{args.diff_from}-v{bundle['version']}.diff.json.gz")
+        with open(diff_file, 'wb') as f:
+            f.write(compress(diff_bundles(old, bundle)))
+        print(f"Diff written to: {diff_file}")
+
+
+if __name__ == "__main__":
+    main()